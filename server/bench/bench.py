@@ -0,0 +1,277 @@
+# Microbenchmarks for the SAP kernels and Pinecone model helpers.
+#
+# Run from the server/ directory:
+#   python -m bench.bench                    # run, check against baseline if present
+#   python -m bench.bench --save             # run, record a new baseline
+#   python -m bench.bench --require-baseline # run, fail if there is no baseline
+#   python -m bench.bench --dims 128 512 --batches 1 16
+#
+# Lives outside src/ so that it is not copied into the enclave image.
+
+import argparse
+import json
+import platform
+import secrets
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Optional
+
+import numpy as np
+
+from src.pc import PineconeResult, PineconeVector
+from src.sap import NONCE_LENGTH, aes_permutation, aes_prng, aes_uniform, sap, unsap
+
+DEFAULT_DIMS = [128, 256, 512, 1024, 1536, 4096]
+DEFAULT_BATCHES = [1, 16, 128]
+DEFAULT_BASELINE = Path(__file__).resolve().parent / "baseline.json"
+# fail when throughput falls below (1 - threshold) * baseline
+DEFAULT_THRESHOLD = 0.25
+
+BETA = 0.1
+# float32 noise is added and removed, so the round trip is not bit-exact
+RTOL = 1e-5
+ATOL = 1e-5
+
+
+def timeit(fn: Callable[[], object], repeat: int, min_time: float) -> float:
+    """
+    Returns the median wall time of a single call to fn, in seconds.
+    Each sample loops fn until at least min_time has elapsed.
+    """
+    fn()  # warmup
+    samples = []
+    for _ in range(repeat):
+        n = 0
+        start = time.perf_counter()
+        while True:
+            fn()
+            n += 1
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_time:
+                break
+        samples.append(elapsed / n)
+    return statistics.median(samples)
+
+
+def make_cases(key: bytes, dim: int, batch: int) -> dict[str, Callable[[], object]]:
+    """
+    Returns the benchmarked callables for one (dim, batch) point.
+    Each callable processes `batch` vectors of dimension `dim`.
+    """
+    rng = np.random.default_rng(dim * 1000 + batch)
+    nonce = secrets.token_bytes(NONCE_LENGTH)
+    plain = rng.standard_normal((batch, dim), dtype=np.float32)
+    cipher = sap(key, plain, beta=BETA, nonce=nonce)
+
+    vectors = [PineconeVector(id=str(i), values=row.tolist()) for i, row in enumerate(plain)]
+    ciphervectors = []
+    for v in vectors:
+        cv = PineconeVector(**v.dict())
+        cv.apply_sap(key, beta=BETA, nonce=nonce)
+        ciphervectors.append(cv.dict())
+    results = [PineconeResult(score=0.0, **v.dict()) for v in vectors]
+    query = PineconeVector(values=plain[0].tolist())
+
+    def bench_apply_sap():
+        for v in vectors:
+            PineconeVector(**v.dict()).apply_sap(key, beta=BETA, nonce=nonce)
+
+    def bench_apply_unsap():
+        for cv in ciphervectors:
+            PineconeVector(**cv).apply_unsap(key)
+
+    def bench_rescore():
+        for r in results:
+            r.rescore(query)
+
+    return {
+        "aes_prng": lambda: aes_prng(key, nonce, batch * dim * 4),
+        "aes_uniform": lambda: aes_uniform(key, nonce, batch * dim),
+        "sap": lambda: sap(key, plain, beta=BETA, nonce=nonce),
+        "unsap": lambda: unsap(key, cipher, beta=BETA, nonce=nonce),
+        "apply_sap": bench_apply_sap,
+        "apply_unsap": bench_apply_unsap,
+        "rescore": bench_rescore,
+    }
+
+
+def check_correctness(key: bytes, dim: int, batch: int) -> list[str]:
+    """
+    Verifies that unsap inverts sap, for both the raw kernels and the
+    Pinecone model helpers. Returns a list of failure descriptions.
+    """
+    failures = []
+    rng = np.random.default_rng(dim * 1000 + batch)
+    nonce = secrets.token_bytes(NONCE_LENGTH)
+    plain = rng.standard_normal((batch, dim), dtype=np.float32)
+
+    for beta in (0.0, BETA):
+        roundtrip = unsap(key, sap(key, plain, beta=beta, nonce=nonce), beta=beta, nonce=nonce)
+        if roundtrip.shape != plain.shape or not np.allclose(
+            roundtrip, plain, rtol=RTOL, atol=ATOL
+        ):
+            failures.append(f"unsap(sap(x)) batched, dim={dim} batch={batch} beta={beta}")
+        for row in plain:
+            rt = unsap(key, sap(key, row, beta=beta, nonce=nonce), beta=beta, nonce=nonce)
+            if not np.allclose(rt, row, rtol=RTOL, atol=ATOL):
+                failures.append(f"unsap(sap(x)) 1D, dim={dim} beta={beta}")
+                break
+
+    v = PineconeVector(id="0", values=plain[0].tolist())
+    v.apply_sap(key, beta=BETA, nonce=nonce)
+    v.apply_unsap(key)
+    if not np.allclose(v.get_np(), plain[0], rtol=RTOL, atol=ATOL):
+        failures.append(f"apply_unsap(apply_sap(x)), dim={dim}")
+
+    perm = aes_permutation(key, dim)
+    if not np.array_equal(np.sort(perm), np.arange(dim, dtype=perm.dtype)):
+        failures.append(f"aes_permutation is not a permutation, dim={dim}")
+
+    return failures
+
+
+def run(
+    dims: list[int], batches: list[int], repeat: int, min_time: float
+) -> dict[str, float]:
+    """
+    Returns throughput in vectors per second, keyed by "name/dim/batch".
+    aes_permutation does not depend on batch size, so it is keyed by
+    "aes_permutation/dim", and measures permutations per second.
+    """
+    key = secrets.token_bytes(32)
+    results = {}
+    for dim in dims:
+        seconds = timeit(lambda: aes_permutation(key, dim), repeat=repeat, min_time=min_time)
+        results[f"aes_permutation/{dim}"] = 1 / seconds
+        print(f"{'aes_permutation':>16} D={dim:<5} {'':<6} {1 / seconds:>14,.1f} perm/s")
+        for batch in batches:
+            for name, fn in make_cases(key, dim, batch).items():
+                seconds = timeit(fn, repeat=repeat, min_time=min_time)
+                results[f"{name}/{dim}/{batch}"] = batch / seconds
+                print(f"{name:>16} D={dim:<5} B={batch:<4} {batch / seconds:>14,.1f} vec/s")
+    return results
+
+
+def machine_info() -> dict[str, str]:
+    """
+    Describes the environment a run was taken in, for recording with a baseline.
+    """
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+    }
+
+
+def compare(
+    results: dict[str, float], baseline: dict[str, float], threshold: float
+) -> tuple[list[str], list[str]]:
+    """
+    Returns a description of every case whose throughput regressed past
+    threshold relative to baseline, and the cases in results that have no
+    baseline entry and so were not checked.
+    """
+    regressions = []
+    unmatched = []
+    for case, throughput in results.items():
+        reference = baseline.get(case)
+        if reference is None:
+            unmatched.append(case)
+            continue
+        ratio = throughput / reference
+        if ratio < 1 - threshold:
+            regressions.append(
+                f"{case}: {throughput:,.1f} vec/s vs baseline {reference:,.1f} ({ratio:.2f}x)"
+            )
+    return regressions, unmatched
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="SAP kernel microbenchmarks.")
+    parser.add_argument("--dims", type=int, nargs="+", default=DEFAULT_DIMS)
+    parser.add_argument("--batches", type=int, nargs="+", default=DEFAULT_BATCHES)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.05)
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument(
+        "--save", action="store_true", help="Overwrite the baseline with this run."
+    )
+    parser.add_argument(
+        "--require-baseline",
+        action="store_true",
+        help=(
+            "Fail instead of skipping the regression check when there is no baseline, "
+            "when any case in this run has no baseline entry, or when the baseline "
+            "was recorded on a different machine."
+        ),
+    )
+    args = parser.parse_args(argv)
+
+    key = secrets.token_bytes(32)
+    failures = []
+    for dim in args.dims:
+        for batch in args.batches:
+            failures += check_correctness(key, dim, batch)
+    if failures:
+        print("Correctness checks failed:")
+        for f in failures:
+            print(f"  {f}")
+        return 1
+    print("Correctness checks passed.")
+
+    results = run(args.dims, args.batches, repeat=args.repeat, min_time=args.min_time)
+
+    if args.save:
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        record = {"machine": machine_info(), "results": results}
+        args.baseline.write_text(json.dumps(record, indent=2, sort_keys=True) + "\n")
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    if not args.baseline.exists():
+        print(f"No baseline at {args.baseline}; run with --save to record one.")
+        return 1 if args.require_baseline else 0
+
+    record = json.loads(args.baseline.read_text())
+    status = 0
+    recorded = record.get("machine", {})
+    mismatched = [
+        f"{k}: baseline {recorded.get(k)!r}, current {v!r}"
+        for k, v in machine_info().items()
+        if recorded.get(k) != v
+    ]
+    if mismatched:
+        print(f"WARNING: {args.baseline} was recorded on a different machine:")
+        for m in mismatched:
+            print(f"  {m}")
+        if args.require_baseline:
+            status = 1
+
+    regressions, unmatched = compare(results, record["results"], args.threshold)
+    if unmatched:
+        print(f"Not checked, missing from {args.baseline}:")
+        for case in unmatched:
+            print(f"  {case}")
+        if args.require_baseline or len(unmatched) == len(results):
+            status = 1
+    if regressions:
+        print(f"Throughput regressed by more than {args.threshold:.0%}:")
+        for r in regressions:
+            print(f"  {r}")
+        return 1
+    if status:
+        print(
+            "Baseline does not cover this run; run on the baseline's machine, "
+            "or re-record the baseline with --save."
+        )
+        return status
+    print(f"No regressions beyond {args.threshold:.0%} against {args.baseline}.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,179 @@
+# On-demand diagnostics for the enclave, where there is no shell and no logs.
+#
+# - sample_stacks: a sampling profiler that runs in a background thread for a
+#   fixed duration, and aggregates the stacks of all other threads.
+# - SlowRequestLog: the slowest requests within a recent time window, with a
+#   per-stage timing breakdown. Only timings and sizes are recorded; never keys
+#   or vectors.
+
+import heapq
+import itertools
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Iterator, Optional
+
+MAX_PROFILE_SECONDS = 60.0
+MIN_SAMPLE_INTERVAL = 0.001
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def sample_stacks(
+    duration: float, interval: float, stop: Optional[threading.Event] = None
+) -> Counter[tuple[str, ...]]:
+    """
+    Samples the stack of every other thread each `interval` seconds, for
+    `duration` seconds or until `stop` is set. Blocks the calling thread; run it
+    off the event loop.
+
+    Returns a count of each observed stack, root first, with the thread name
+    as the outermost frame.
+    """
+    stop = stop or threading.Event()
+    me = threading.get_ident()
+    counts: Counter[tuple[str, ...]] = Counter()
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline and not stop.is_set():
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            stack.append(names.get(ident, f"thread-{ident}"))
+            counts[tuple(reversed(stack))] += 1
+        stop.wait(interval)
+    return counts
+
+
+def to_collapsed(counts: Counter[tuple[str, ...]]) -> str:
+    """
+    Formats stacks as "frame;frame;frame count" lines, as consumed by
+    flamegraph.pl, speedscope and most other flamegraph viewers.
+    """
+    lines = [f"{';'.join(stack)} {n}" for stack, n in counts.most_common()]
+    return "\n".join(lines) + "\n"
+
+
+def to_flamegraph(counts: Counter[tuple[str, ...]]) -> dict[str, Any]:
+    """
+    Formats stacks as a nested {name, value, children} tree, as consumed by
+    d3-flame-graph.
+    """
+    root: dict[str, Any] = {"name": "all", "value": 0, "children": {}}
+    for stack, n in counts.items():
+        node = root
+        node["value"] += n
+        for label in stack:
+            node = node["children"].setdefault(
+                label, {"name": label, "value": 0, "children": {}}
+            )
+            node["value"] += n
+
+    def finalize(node: dict[str, Any]) -> dict[str, Any]:
+        children = sorted(node["children"].values(), key=lambda c: -c["value"])
+        return {**node, "children": [finalize(c) for c in children]}
+
+    return finalize(root)
+
+
+class RequestTimer:
+    """
+    Per-request timing breakdown. Stages are timed with `stage`, and sizes are
+    attached with `note`. Only numbers are accepted, so that request contents
+    cannot end up in the log.
+    """
+
+    def __init__(self, route: str):
+        self.route = route
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.total_ms = 0.0
+        self.stages: dict[str, float] = {}
+        self.sizes: dict[str, int | float] = {}
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            self.stages[name] = self.stages.get(name, 0.0) + elapsed
+
+    def note(self, **sizes: int | float):
+        for name, value in sizes.items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                raise TypeError(f"Size {name} must be a number.")
+            self.sizes[name] = value
+
+    def finish(self):
+        self.total_ms = (time.perf_counter() - self.start) * 1000
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "route": self.route,
+            "started_at": self.started_at,
+            "total_ms": self.total_ms,
+            "stages_ms": self.stages,
+            "sizes": self.sizes,
+        }
+
+
+class SlowRequestLog:
+    """
+    The `capacity` slowest requests started within the last `window_s` seconds.
+    Entries are kept in a min-heap by total time, so a burst of fast requests
+    never pushes out a slow one; only a slower request or the window expiring does.
+    """
+
+    def __init__(self, capacity: int = 100, window_s: float = 600.0):
+        self.capacity = capacity
+        self.window_s = window_s
+        # (total_ms, sequence, timer); sequence breaks ties between equal times
+        self.heap: list[tuple[float, int, RequestTimer]] = []
+        self.sequence = itertools.count()
+        self.last_pruned = 0.0
+
+    @contextmanager
+    def track(self, route: str) -> Iterator[RequestTimer]:
+        timer = RequestTimer(route)
+        try:
+            yield timer
+        except BaseException:
+            timer.note(failed=1)
+            raise
+        finally:
+            timer.finish()
+            self.record(timer)
+
+    def record(self, timer: RequestTimer):
+        now = time.time()
+        # pruning is O(capacity), so do it at most once a second
+        if now - self.last_pruned >= 1.0:
+            self.prune(now)
+        entry = (timer.total_ms, next(self.sequence), timer)
+        if len(self.heap) < self.capacity:
+            heapq.heappush(self.heap, entry)
+        elif timer.total_ms > self.heap[0][0]:
+            heapq.heapreplace(self.heap, entry)
+
+    def prune(self, now: float):
+        cutoff = now - self.window_s
+        self.heap = [e for e in self.heap if e[2].started_at >= cutoff]
+        heapq.heapify(self.heap)
+        self.last_pruned = now
+
+    def slowest(self, limit: Optional[int] = None) -> list[dict[str, Any]]:
+        self.prune(time.time())
+        ranked = sorted(self.heap, key=lambda e: -e[0])
+        return [timer.to_dict() for _, _, timer in ranked[:limit]]
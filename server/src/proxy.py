@@ -1,25 +1,53 @@
+import asyncio
 import base64
+import hashlib
 import json
 import secrets
-from typing import Annotated, Any, Optional
+import threading
+from typing import Annotated, Any, Literal, Optional
 from urllib.parse import urlparse
 
 import httpx
-from fastapi import Body, FastAPI, Header, Request, Response
+from fastapi import Body, FastAPI, Header, HTTPException, Query, Request, Response
 
 from .sap import NONCE_LENGTH
 from .pc import PineconeQuery, PineconeResult, PineconeUpsert
+from .profiling import (
+    MAX_PROFILE_SECONDS,
+    MIN_SAMPLE_INTERVAL,
+    SlowRequestLog,
+    sample_stacks,
+    to_collapsed,
+    to_flamegraph,
+)
 
 app = FastAPI()
 
 PINECONE_CONTROLLER_URL = None
 UPSTREAM_URL = None
 BETA = 0.1
+# sha256 of the admin token; admin endpoints are disabled until it is set
+ADMIN_TOKEN_HASH: Optional[bytes] = None
+
+# the 256 slowest requests of the last 10 minutes
+SLOW_REQUESTS = SlowRequestLog(capacity=256, window_s=600.0)
+PROFILER_LOCK = threading.Lock()
 
 
 DataKey = Annotated[
     str, Header(..., alias="x-data-key", description="The data key, encoded as base64.")
 ]
+AdminToken = Annotated[
+    str, Header(..., alias="x-admin-token", description="The admin token set at setup.")
+]
+
+
+def check_admin_token(admin_token: str):
+    if ADMIN_TOKEN_HASH is None:
+        raise HTTPException(status_code=403, detail="Admin token has not been set.")
+    presented = hashlib.sha256(admin_token.encode("utf8")).digest()
+    if not secrets.compare_digest(presented, ADMIN_TOKEN_HASH):
+        raise HTTPException(status_code=403, detail="Invalid admin token.")
 
 
 def resolve_controller_from_upstream(upstream_url: str) -> str:
@@ -49,14 +77,104 @@ async def set_upstream(
             ),
         ),
     ] = 0.0,
+    admin_token: Annotated[
+        Optional[str],
+        Body(
+            description=(
+                "Token required by the /blyss/admin endpoints. "
+                "Can only be set once per enclave lifetime; "
+                "a different token on a later setup is rejected with 409. "
+                "Until a token is set, the admin endpoints are disabled."
+            ),
+        ),
+    ] = None,
 ):
-    global UPSTREAM_URL, PINECONE_CONTROLLER_URL, BETA
+    global UPSTREAM_URL, PINECONE_CONTROLLER_URL, BETA, ADMIN_TOKEN_HASH
+    admin_token_hash = None
+    if admin_token:
+        admin_token_hash = hashlib.sha256(admin_token.encode("utf8")).digest()
+        # reject before changing any state, so a caller locked out of the
+        # admin endpoints finds out, rather than having their token ignored
+        if ADMIN_TOKEN_HASH is not None and not secrets.compare_digest(
+            admin_token_hash, ADMIN_TOKEN_HASH
+        ):
+            raise HTTPException(
+                status_code=409, detail="A different admin token is already set."
+            )
+
     UPSTREAM_URL = upstream
     PINECONE_CONTROLLER_URL = resolve_controller_from_upstream(upstream)
     BETA = beta
     print(f"UPSTREAM_URL set to {UPSTREAM_URL}")
     print(f"PINECONE_CONTROLLER_URL set to {PINECONE_CONTROLLER_URL}")
     print(f"BETA set to {BETA}")
+    if admin_token_hash is not None and ADMIN_TOKEN_HASH is None:
+        ADMIN_TOKEN_HASH = admin_token_hash
+        print("ADMIN_TOKEN set")
+
+    if ADMIN_TOKEN_HASH is None:
+        warning = (
+            "No admin token is set. The /blyss/admin endpoints are disabled, "
+            "and the first setup call with an admin_token will claim them."
+        )
+        print(f"WARNING: {warning}")
+        return {"warning": warning}
+
+
+@app.post("/blyss/admin/profile")
+async def profile(
+    admin_token: AdminToken,
+    duration: Annotated[
+        float, Query(gt=0, le=MAX_PROFILE_SECONDS, description="Seconds to sample for.")
+    ] = 10.0,
+    interval: Annotated[
+        float,
+        Query(ge=MIN_SAMPLE_INTERVAL, le=1.0, description="Seconds between samples."),
+    ] = 0.005,
+    format: Annotated[
+        Literal["collapsed", "flamegraph"],
+        Query(
+            description=(
+                "collapsed: folded stacks as text, one 'frame;frame count' per line. "
+                "flamegraph: nested JSON tree, as used by d3-flame-graph."
+            ),
+        ),
+    ] = "collapsed",
+):
+    check_admin_token(admin_token)
+    if not PROFILER_LOCK.acquire(blocking=False):
+        raise HTTPException(status_code=409, detail="A profile is already running.")
+    stop = threading.Event()
+
+    def run():
+        # released by the worker, so the lock is held until sampling has stopped
+        try:
+            return sample_stacks(duration, interval, stop)
+        finally:
+            PROFILER_LOCK.release()
+
+    # sample from a worker thread, so the event loop keeps serving requests.
+    # Shielded so that a disconnect cannot cancel the worker before it starts,
+    # which would leave the lock held.
+    worker = asyncio.ensure_future(asyncio.to_thread(run))
+    try:
+        counts = await asyncio.shield(worker)
+    except asyncio.CancelledError:
+        stop.set()
+        raise
+
+    if format == "flamegraph":
+        return to_flamegraph(counts)
+    return Response(content=to_collapsed(counts), media_type="text/plain")
+
+
+@app.get("/blyss/admin/slow_requests")
+async def slow_requests(
+    admin_token: AdminToken,
+    limit: Annotated[int, Query(gt=0, description="Maximum entries to return.")] = 20,
+):
+    check_admin_token(admin_token)
+    return {"requests": SLOW_REQUESTS.slowest(limit)}
 
 
 async def forward_to_upstream(
@@ -105,44 +223,57 @@ async def query(
     ],
     data_key: DataKey,
 ):
-    if plainquery.id:
-        # no change for id-based queries, passthrough
-        return await forward_to_upstream(
-            "query",
-            request,
-        )
-
-    # apply SAP to plaintext query
-    key = base64.b64decode(data_key)
-    nonce = secrets.token_bytes(NONCE_LENGTH)
-    cipherquery = PineconeQuery(**plainquery.dict())
-    cipherquery.apply_sap(key, beta=BETA, nonce=nonce)
-    # force query params to allow effective unSAP
-    cipherquery.includeValues = True
-    cipherquery.includeMetadata = True
-    cipherquery.topK = plainquery.topK * 3
-
-    # rename values to vector; Pinecone uses inconsistent naming between query and upsert
-    cipherquery_json = cipherquery.dict(exclude_none=True)
-    cipherquery_json["vector"] = cipherquery_json.pop("values")
-
-    response = await forward_to_upstream("query", request, json=cipherquery_json)
-
-    # apply unsap to each vector in matches
-    rj = response.json()
-    matches = [PineconeResult(**m) for m in rj["matches"]]
-
-    # snapshot the ciphermatches, for debugging
-    ciphermatches = [m.dict(exclude_none=True) for m in matches]
-
-    for m in matches:
-        m.apply_unsap(key)
-        # rescore the matches by computing distances in the plaintext space
-        m.rescore(plainquery)
-
-    filtered_matches = sorted(matches, key=lambda m: m.score)[: plainquery.topK]
-
-    return {"matches": filtered_matches, "ciphermatches": ciphermatches}
+    with SLOW_REQUESTS.track("query") as timer:
+        timer.note(topK=plainquery.topK)
+        if plainquery.id:
+            # no change for id-based queries, passthrough
+            with timer.stage("upstream"):
+                return await forward_to_upstream(
+                    "query",
+                    request,
+                )
+
+        # apply SAP to plaintext query
+        with timer.stage("sap"):
+            key = base64.b64decode(data_key)
+            nonce = secrets.token_bytes(NONCE_LENGTH)
+            cipherquery = PineconeQuery(**plainquery.dict())
+            cipherquery.apply_sap(key, beta=BETA, nonce=nonce)
+            # force query params to allow effective unSAP
+            cipherquery.includeValues = True
+            cipherquery.includeMetadata = True
+            cipherquery.topK = plainquery.topK * 3
+
+            # rename values to vector; Pinecone uses inconsistent naming between query and upsert
+            cipherquery_json = cipherquery.dict(exclude_none=True)
+            cipherquery_json["vector"] = cipherquery_json.pop("values")
+        timer.note(dim=len(cipherquery_json["vector"]))
+
+        with timer.stage("upstream"):
+            response = await forward_to_upstream("query", request, json=cipherquery_json)
+        timer.note(upstream_status=response.status_code, upstream_bytes=len(response.content))
+
+        # apply unsap to each vector in matches
+        with timer.stage("parse"):
+            rj = response.json()
+            matches = [PineconeResult(**m) for m in rj["matches"]]
+
+            # snapshot the ciphermatches, for debugging
+            ciphermatches = [m.dict(exclude_none=True) for m in matches]
+        timer.note(matches=len(matches))
+
+        with timer.stage("unsap"):
+            for m in matches:
+                m.apply_unsap(key)
+
+        with timer.stage("rescore"):
+            for m in matches:
+                # rescore the matches by computing distances in the plaintext space
+                m.rescore(plainquery)
+
+            filtered_matches = sorted(matches, key=lambda m: m.score)[: plainquery.topK]
+
+        return {"matches": filtered_matches, "ciphermatches": ciphermatches}
 
 
 @app.post("/vectors/upsert")
@@ -158,21 +289,28 @@ async def upsert(
     ],
     data_key: DataKey,
 ):
-    key = base64.b64decode(data_key)
-    for v in upsert.vectors:
-        # apply SAP
-        nonce = secrets.token_bytes(NONCE_LENGTH)
-        v.apply_sap(key, beta=BETA, nonce=nonce)
-
-    pcresponse = await forward_to_upstream(
-        "vectors/upsert", request, json=upsert.dict(exclude_none=True)
-    )
+    with SLOW_REQUESTS.track("vectors/upsert") as timer:
+        timer.note(vectors=len(upsert.vectors))
+        with timer.stage("sap"):
+            key = base64.b64decode(data_key)
+            for v in upsert.vectors:
+                # apply SAP
+                nonce = secrets.token_bytes(NONCE_LENGTH)
+                v.apply_sap(key, beta=BETA, nonce=nonce)
+
+        with timer.stage("upstream"):
+            pcresponse = await forward_to_upstream(
+                "vectors/upsert", request, json=upsert.dict(exclude_none=True)
+            )
+        timer.note(
+            upstream_status=pcresponse.status_code, upstream_bytes=len(pcresponse.content)
+        )
 
-    return Response(
-        content=pcresponse.content,
-        status_code=pcresponse.status_code,
-        headers=dict(pcresponse.headers),
-    )
+        return Response(
+            content=pcresponse.content,
+            status_code=pcresponse.status_code,
+            headers=dict(pcresponse.headers),
+        )
 
 
 @app.api_route("/{path:path}", methods=["GET", "POST", "PUT", "DELETE", "PATCH"])
@@ -187,7 +325,11 @@ async def proxy(path: str, request: Request):
         # all other Pinecone API calls go to the general controller
         upstream = PINECONE_CONTROLLER_URL
 
-    response = await forward_to_upstream(path, request, upstream=upstream)
+    # record the route by its first segment only; paths can contain ids
+    with SLOW_REQUESTS.track(path.split("/")[0]) as timer:
+        with timer.stage("upstream"):
+            response = await forward_to_upstream(path, request, upstream=upstream)
+        timer.note(upstream_status=response.status_code, upstream_bytes=len(response.content))
 
     return Response(
         content=response.content,
@@ -61,7 +61,7 @@ def sap(key: bytes, plainvec: np.ndarray, beta: float, nonce: bytes):
     """
     SAP: Shuffle-and-Perturb
 
-    plainvec: a 1D numpy array, representing a single vector
+    plainvec: a numpy array of shape [D] for a single vector, or [..., D] for a batch
     beta: scalar factor >= 0.
           Larger beta increases security (i.e. harder to recover plainvec from ciphervec)
           at the cost of less-accurate distance comparisons in the encrypted space.
@@ -93,7 +93,7 @@ def unsap(key: bytes, ciphervec: np.ndarray, beta: float, nonce: bytes):
     """
     Inverse of SAP
 
-    ciphervec: a 1D numpy array, representing a single vector
+    ciphervec: a numpy array of shape [D] for a single vector, or [..., D] for a batch
     beta: the same beta used in SAP
     nonce: the same nonce used in SAP
 
@@ -107,7 +107,10 @@ def unsap(key: bytes, ciphervec: np.ndarray, beta: float, nonce: bytes):
 
     shuffle_map = aes_permutation(key, D)
     unshuffle_map = np.argsort(shuffle_map)
-    plainvec = shuffled[unshuffle_map]
+    if len(ciphervec.shape) == 1:
+        plainvec = shuffled[unshuffle_map]
+    else:
+        plainvec = shuffled[..., unshuffle_map]
 
     return plainvec
 
@@ -0,0 +1,25 @@
+import unittest
+
+from bench.bench import compare
+
+
+class TestCompare(unittest.TestCase):
+    def test_regression(self):
+        regressions, unmatched = compare({"sap/128/1": 50.0}, {"sap/128/1": 100.0}, 0.25)
+        self.assertEqual(len(regressions), 1)
+        self.assertEqual(unmatched, [])
+
+    def test_within_threshold(self):
+        regressions, unmatched = compare({"sap/128/1": 80.0}, {"sap/128/1": 100.0}, 0.25)
+        self.assertEqual((regressions, unmatched), ([], []))
+
+    def test_unmatched(self):
+        regressions, unmatched = compare(
+            {"sap/128/1": 100.0, "unsap/128/1": 100.0}, {"sap/9999/1": 100.0}, 0.25
+        )
+        self.assertEqual(regressions, [])
+        self.assertEqual(unmatched, ["sap/128/1", "unsap/128/1"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+import threading
+import time
+import unittest
+from collections import Counter
+from typing import Optional
+
+import numpy as np
+
+from src.profiling import (
+    RequestTimer,
+    SlowRequestLog,
+    sample_stacks,
+    to_collapsed,
+    to_flamegraph,
+)
+
+
+def make_timer(total_ms: float, started_at: Optional[float] = None) -> RequestTimer:
+    timer = RequestTimer("query")
+    timer.total_ms = total_ms
+    if started_at is not None:
+        timer.started_at = started_at
+    return timer
+
+
+class TestFormats(unittest.TestCase):
+    def setUp(self):
+        self.counts = Counter({("main", "a", "b"): 3, ("main", "a"): 1, ("main", "c"): 2})
+
+    def test_collapsed(self):
+        self.assertEqual(to_collapsed(self.counts), "main;a;b 3\nmain;c 2\nmain;a 1\n")
+
+    def test_flamegraph(self):
+        tree = to_flamegraph(self.counts)
+        self.assertEqual(tree["name"], "all")
+        self.assertEqual(tree["value"], 6)
+        (main,) = tree["children"]
+        self.assertEqual(main["value"], 6)
+        self.assertEqual(
+            [(c["name"], c["value"]) for c in main["children"]], [("a", 4), ("c", 2)]
+        )
+        (b,) = main["children"][0]["children"]
+        self.assertEqual((b["name"], b["value"], b["children"]), ("b", 3, []))
+
+
+class TestRequestTimer(unittest.TestCase):
+    def test_note_accepts_numbers(self):
+        timer = RequestTimer("query")
+        timer.note(dim=512, upstream_bytes=1024, ratio=0.5)
+        self.assertEqual(timer.sizes, {"dim": 512, "upstream_bytes": 1024, "ratio": 0.5})
+
+    def test_note_rejects_non_numbers(self):
+        timer = RequestTimer("query")
+        for value in [b"\x00" * 32, "key", [0.1, 0.2], np.zeros(4), {"a": 1}, None, True]:
+            with self.assertRaises(TypeError):
+                timer.note(value=value)
+        self.assertEqual(timer.sizes, {})
+
+    def test_stages(self):
+        timer = RequestTimer("query")
+        with timer.stage("sap"):
+            pass
+        with timer.stage("sap"):
+            pass
+        timer.finish()
+        self.assertEqual(list(timer.stages), ["sap"])
+        self.assertGreaterEqual(timer.total_ms, timer.stages["sap"])
+
+
+class TestSlowRequestLog(unittest.TestCase):
+    def test_keeps_slowest(self):
+        log = SlowRequestLog(capacity=3)
+        for ms in [50, 1, 2, 900, 3, 4, 5, 6, 100, 7]:
+            log.record(make_timer(ms))
+        self.assertEqual([e["total_ms"] for e in log.slowest()], [900, 100, 50])
+        self.assertEqual([e["total_ms"] for e in log.slowest(2)], [900, 100])
+
+    def test_window_expiry(self):
+        log = SlowRequestLog(capacity=3, window_s=60)
+        log.record(make_timer(5000, started_at=time.time() - 120))
+        log.record(make_timer(10))
+        self.assertEqual([e["total_ms"] for e in log.slowest()], [10])
+
+    def test_track_records_failures(self):
+        log = SlowRequestLog()
+        with self.assertRaises(ValueError):
+            with log.track("query"):
+                raise ValueError()
+        (entry,) = log.slowest()
+        self.assertEqual(entry["sizes"], {"failed": 1})
+
+
+class TestSampleStacks(unittest.TestCase):
+    def test_stop(self):
+        stop = threading.Event()
+        stop.set()
+        start = time.monotonic()
+        sample_stacks(30, 0.01, stop)
+        self.assertLess(time.monotonic() - start, 1)
+
+    def test_samples_other_threads(self):
+        result = {}
+        sampler = threading.Thread(
+            target=lambda: result.update(counts=sample_stacks(0.05, 0.01))
+        )
+        sampler.start()
+        sampler.join()
+        self.assertTrue(any(stack[0] == "MainThread" for stack in result["counts"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
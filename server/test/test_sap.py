@@ -0,0 +1,42 @@
+import secrets
+import unittest
+
+import numpy as np
+
+from src.sap import NONCE_LENGTH, aes_permutation, sap, unsap
+
+
+class TestSap(unittest.TestCase):
+    def setUp(self):
+        self.key = secrets.token_bytes(32)
+        self.nonce = secrets.token_bytes(NONCE_LENGTH)
+        rng = np.random.default_rng(0)
+        self.batch = rng.standard_normal((8, 64), dtype=np.float32)
+
+    def test_permutation(self):
+        perm = aes_permutation(self.key, 64)
+        np.testing.assert_array_equal(np.sort(perm), np.arange(64, dtype=perm.dtype))
+
+    def test_roundtrip_1d(self):
+        for beta in (0.0, 0.1):
+            plainvec = self.batch[0]
+            ciphervec = sap(self.key, plainvec, beta=beta, nonce=self.nonce)
+            roundtrip = unsap(self.key, ciphervec, beta=beta, nonce=self.nonce)
+            np.testing.assert_allclose(roundtrip, plainvec, rtol=1e-5, atol=1e-5)
+
+    def test_roundtrip_2d(self):
+        for beta in (0.0, 0.1):
+            ciphervec = sap(self.key, self.batch, beta=beta, nonce=self.nonce)
+            roundtrip = unsap(self.key, ciphervec, beta=beta, nonce=self.nonce)
+            self.assertEqual(roundtrip.shape, self.batch.shape)
+            np.testing.assert_allclose(roundtrip, self.batch, rtol=1e-5, atol=1e-5)
+
+    def test_batch_matches_rows(self):
+        ciphervec = sap(self.key, self.batch, beta=0.1, nonce=self.nonce)
+        for row, cipherrow in zip(self.batch, ciphervec):
+            expected = sap(self.key, row, beta=0.1, nonce=self.nonce)
+            np.testing.assert_array_equal(cipherrow, expected)
+
+
+if __name__ == "__main__":
+    unittest.main()